@@ -2,9 +2,50 @@ from dotenv import dotenv_values
 from urllib.parse import urlparse, unquote
 from pymysql.converters import escape_string
 import pymysql
+import pymysql.cursors
+from pymysql.constants import FIELD_TYPE
+import datetime
 import os
 import sys
 
+# Rows per extended INSERT statement written to product_details.sql
+ROWS_PER_INSERT = 500
+
+_NUMERIC_TYPES = {
+    FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG, FIELD_TYPE.LONGLONG,
+    FIELD_TYPE.INT24, FIELD_TYPE.YEAR, FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE,
+}
+_TEMPORAL_TYPES = {
+    FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE, FIELD_TYPE.DATETIME,
+    FIELD_TYPE.TIMESTAMP, FIELD_TYPE.TIME,
+}
+_TEXT_TYPES = {
+    FIELD_TYPE.STRING, FIELD_TYPE.VAR_STRING, FIELD_TYPE.VARCHAR, FIELD_TYPE.JSON,
+    FIELD_TYPE.TINY_BLOB, FIELD_TYPE.MEDIUM_BLOB, FIELD_TYPE.LONG_BLOB, FIELD_TYPE.BLOB,
+    FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL, FIELD_TYPE.ENUM, FIELD_TYPE.SET,
+}
+
+def _quote_text(val):
+    # TEXT columns share BLOB type codes; only binary-collated ones come back as bytes
+    if isinstance(val, bytes):
+        return "0x" + val.hex()
+    return "'" + escape_string(str(val)) + "'"
+
+def pick_formatter(type_code, fallback):
+    """
+    Returns a per-column formatter for non-NULL cells, chosen once from the
+    cursor.description type code so each cell costs a single call.
+    """
+    if type_code in _NUMERIC_TYPES:
+        return str
+    if type_code in _TEMPORAL_TYPES:
+        return lambda val: "'" + str(val) + "'"
+    if type_code == FIELD_TYPE.BIT:
+        return lambda val: "0x" + val.hex()
+    if type_code in _TEXT_TYPES:
+        return _quote_text
+    return fallback
+
 def main():
     env_path = r"c:\Users\emman\OneDrive\Desktop\steadfast_ml\.env"
     cfg = dotenv_values(env_path)
@@ -26,11 +67,10 @@ def main():
         print("Missing database configuration in .env")
         sys.exit(1)
     try:
-        conn = pymysql.connect(host=host, user=user, password=password, database=database, port=port, charset="utf8mb4")
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM `products`")
-            rows = cursor.fetchall()
-            cols = [desc[0] for desc in cursor.description]
+        conn = pymysql.connect(
+            host=host, user=user, password=password, database=database, port=port, charset="utf8mb4",
+            cursorclass=pymysql.cursors.SSCursor,
+        )
         def sql_literal(val):
             if val is None:
                 return "NULL"
@@ -38,19 +78,26 @@ def main():
                 return str(val)
             if isinstance(val, bytes):
                 return "0x" + val.hex()
-            try:
-                import datetime
-                if isinstance(val, (datetime.date, datetime.datetime, datetime.time)):
-                    return "'" + str(val) + "'"
-            except Exception:
-                pass
+            if isinstance(val, (datetime.date, datetime.datetime, datetime.time)):
+                return "'" + str(val) + "'"
             s = escape_string(str(val))
             return "'" + s + "'"
         outfile = os.path.join(os.getcwd(), "product_details.sql")
-        with open(outfile, "w", encoding="utf-8") as f:
-            for row in rows:
-                values = ", ".join(sql_literal(v) for v in row)
-                f.write(f"INSERT INTO `products` ({', '.join('`'+c+'`' for c in cols)}) VALUES ({values});\n")
+        # SSCursor streams rows from the server instead of buffering the whole table
+        with conn.cursor() as cursor, open(outfile, "wb", buffering=1 << 20) as f:
+            cursor.execute("SELECT * FROM `products`")
+            cols = [desc[0] for desc in cursor.description]
+            formatters = [pick_formatter(desc[1], sql_literal) for desc in cursor.description]
+            header = f"INSERT INTO `products` ({', '.join('`'+c+'`' for c in cols)}) VALUES "
+            batch = []
+            for row in cursor:
+                values = ", ".join("NULL" if v is None else fmt(v) for fmt, v in zip(formatters, row))
+                batch.append("(" + values + ")")
+                if len(batch) == ROWS_PER_INSERT:
+                    f.write((header + ",".join(batch) + ";\n").encode("utf-8"))
+                    batch.clear()
+            if batch:
+                f.write((header + ",".join(batch) + ";\n").encode("utf-8"))
         print(outfile)
     except Exception as e:
         print(str(e))
@@ -1,17 +1,27 @@
 import os
 import threading
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import numpy as np
 
-from .config import DATA_DIR
-from .db import fetch_product, fetch_all_products
-from .embeddings import get_embedding_for_product, get_embedding_for_query, get_model, get_embedding_dim
+from .config import DATA_DIR, load_config
+from .db import fetch_product, fetch_all_products, fetch_products_bulk
+from .embeddings import (
+    get_embedding_for_product,
+    get_embeddings_for_products,
+    get_embedding_for_query,
+    get_model,
+    get_embedding_dim,
+    sort_by_text_length,
+    warm_up,
+)
 from .index_store import FaissIndexStore
-from .utils import parse_product_rows_from_sql
+from .json_utils import OrjsonProvider
+from .utils import chunks, parse_product_rows_from_sql, sql_rows_by_id
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 os.makedirs(DATA_DIR, exist_ok=True)
 _allowed_origins = [
     "http://localhost:3000",
@@ -27,6 +37,76 @@ _index_ready: bool = False
 _index_progress = {"total": 0, "processed": 0}
 _index_error: str = ""
 
+# Number of products embedded per batched model call during index builds.
+_EMBED_CHUNK_SIZE = 256
+
+def _embed_rows(rows: List[Dict]) -> Tuple[List[int], Optional[np.ndarray]]:
+    """
+    Embeds a chunk of product rows in one batched pass.
+    Returns aligned (product_ids, vectors); rows without a usable id are dropped.
+    Falls back to per-row embedding so a single bad row doesn't lose the chunk.
+    """
+    keyed = []
+    for row in rows:
+        try:
+            keyed.append((int(row.get("productId") or row.get("id")), row))
+        except Exception:
+            continue
+    if not keyed:
+        return [], None
+    pids = [pid for pid, _ in keyed]
+    try:
+        return pids, get_embeddings_for_products([row for _, row in keyed])
+    except Exception:
+        pass
+    pids, vecs = [], []
+    for pid, row in keyed:
+        try:
+            vecs.append(get_embedding_for_product(row))
+            pids.append(pid)
+        except Exception:
+            continue
+    if not pids:
+        return [], None
+    return pids, np.stack(vecs, axis=0)
+
+# Product ids per bulk fetch when warming the in-memory product map.
+_HYDRATE_CHUNK_SIZE = 1000
+
+# Largest top_k accepted by /search.
+_MAX_TOP_K = 1000
+
+def _hydrate(store: FaissIndexStore, pids: List[int]) -> Dict[int, Dict]:
+    """
+    Returns {product_id: row} for pids, served from store.products when possible.
+    Misses are bulk-fetched from MySQL (falling back to the SQL dump) and
+    remembered on the store.
+    """
+    found = {pid: store.products[pid] for pid in pids if pid in store.products}
+    missing = [pid for pid in pids if pid not in found]
+    if missing:
+        try:
+            fetched = fetch_products_bulk(missing)
+        except Exception:
+            fetched = {}
+        sql_rows = sql_rows_by_id() if len(fetched) < len(missing) else {}
+        for pid in missing:
+            row = fetched.get(pid) or sql_rows.get(pid)
+            if row:
+                store.products[pid] = row
+                found[pid] = row
+    return found
+
+def _warm_products(store: FaissIndexStore):
+    """
+    Loads rows for every indexed product so /search never waits on MySQL.
+    """
+    try:
+        for part in chunks(store.mapping.tolist(), _HYDRATE_CHUNK_SIZE):
+            _hydrate(store, part)
+    except Exception:
+        pass
+
 def _init_index():
     """
     Initializes FAISS index and loads/creates persistence.
@@ -35,11 +115,16 @@ def _init_index():
     """
     global _index, _index_ready, _index_progress, _index_error
     dim = int(get_embedding_dim())
+    try:
+        warm_up()
+    except Exception:
+        pass
     store = FaissIndexStore(dim=dim)
     if store.load_if_exists():
         _index = store
         _index_ready = True
         _index_progress = {"total": len(store.mapping), "processed": len(store.mapping)}
+        _warm_products(store)
         return
     try:
         products: List[Dict]
@@ -51,29 +136,27 @@ def _init_index():
         if not products:
             products = parse_product_rows_from_sql()
 
-        _index = store
+        _index = store = FaissIndexStore(dim=dim, size_hint=len(products))
         _index_progress = {"total": len(products), "processed": 0}
 
-        # Incremental build: add vectors one by one and mark ready after first batch
+        # Incremental build: add vectors chunk by chunk and mark ready after first batch.
+        # Trained index types buffer vectors until they can train, so
+        # readiness also waits until the index actually holds vectors.
         batch_threshold = 30
-        for row in products:
-            try:
-                # Skip deleted products
-                if str(row.get("is_deleted")) == "1":
-                    _index_progress["processed"] += 1
-                    continue
-                pid = int(row.get("productId") or row.get("id"))
-                vec = get_embedding_for_product(row)
-                _index.add(pid, vec)
-                _index_progress["processed"] += 1
-                if not _index_ready and _index_progress["processed"] >= batch_threshold:
-                    _index_ready = True
-            except Exception:
-                _index_progress["processed"] += 1
-                continue
+        for chunk in chunks(sort_by_text_length(products), _EMBED_CHUNK_SIZE):
+            # Skip deleted products
+            live = [row for row in chunk if str(row.get("is_deleted")) != "1"]
+            pids, vecs = _embed_rows(live)
+            if pids:
+                _index.add_batch(pids, vecs)
+            _index_progress["processed"] += len(chunk)
+            if not _index_ready and _index_progress["processed"] >= batch_threshold and len(_index.mapping):
+                _index_ready = True
 
+        _index.flush()
         _index_ready = True
         _index.save()
+        _warm_products(_index)
     except Exception as e:
         _index_error = str(e)
 
@@ -97,49 +180,22 @@ def add_product(product_id: int):
         return jsonify({"error": "product is deleted"}), 400
     vec = get_embedding_for_product(row)
     _index.add(product_id, vec)
-    _index.save()
+    _index.products[product_id] = row
+    _index.save_async()
     return jsonify({"status": "added", "product_id": product_id})
 
 @app.route("/delete-product/<int:product_id>", methods=["POST"])
 def delete_product(product_id: int):
     """
-    Removes a product from the FAISS index by rebuilding without it.
+    Removes a product from the FAISS index in place (FAISS remove_ids).
     Persists index and mapping.
     """
     global _index
     if not _index_ready:
         return jsonify({"error": "index initializing"}), 503
-    remaining_ids = [pid for pid in _index.mapping if pid != product_id]
-
-    # Try MySQL; fallback to SQL dump for rows
-    rows: Dict[int, Dict] = {}
-    try:
-        for pid in remaining_ids:
-            row = fetch_product(pid)
-            if row:
-                rows[pid] = row
-    except Exception:
-        pass
-
-    if not rows:
-        for row in parse_product_rows_from_sql():
-            pid = int(row.get("id"))
-            if pid in remaining_ids:
-                rows[pid] = row
-
-    items = []
-    for pid in remaining_ids:
-        row = rows.get(pid)
-        if not row:
-            continue
-        try:
-            vec = get_embedding_for_product(row)
-            items.append((pid, vec))
-        except Exception:
-            continue
-
-    _index.rebuild(items)
-    _index.save()
+    _index.remove(product_id)
+    _index.products.pop(product_id, None)
+    _index.save_async()
     return jsonify({"status": "deleted", "product_id": product_id})
 
 @app.route("/rebuild", methods=["GET"])
@@ -149,7 +205,6 @@ def rebuild_index():
         global _index, _index_ready, _index_progress, _index_error
         try:
             dim = int(get_embedding_dim())
-            store = FaissIndexStore(dim=dim)
             products: List[Dict]
             try:
                 products = fetch_all_products()
@@ -157,23 +212,17 @@ def rebuild_index():
                 products = []
             if not products:
                 products = parse_product_rows_from_sql()
+            store = FaissIndexStore(dim=dim, size_hint=len(products))
             _index_progress = {"total": len(products), "processed": 0}
-            items = []
-            for row in products:
-                try:
-                    pid = int(row.get("productId") or row.get("id"))
-                except Exception:
-                    _index_progress["processed"] += 1
-                    continue
-                try:
-                    vec = get_embedding_for_product(row)
-                except Exception:
-                    _index_progress["processed"] += 1
-                    continue
-                items.append((pid, vec))
-                _index_progress["processed"] += 1
-            store.rebuild(items)
+            for chunk in chunks(sort_by_text_length(products), _EMBED_CHUNK_SIZE):
+                pids, vecs = _embed_rows(chunk)
+                if pids:
+                    store.add_batch(pids, vecs)
+                _index_progress["processed"] += len(chunk)
+            if _index is not None:
+                _index.retire()
             store.save()
+            _warm_products(store)
             _index = store
             _index_ready = True
         except Exception as e:
@@ -189,6 +238,7 @@ def search():
     """
     Searches for similar products.
     Accepts JSON: { "query": "<image URL or text>", "top_k": 5 }
+    top_k must be a positive integer; values above 1000 are capped.
     Returns full product rows with similarity scores.
     """
     global _index
@@ -196,26 +246,24 @@ def search():
         return jsonify({"error": "index initializing"}), 503
     data = request.get_json(force=True) or {}
     query = str(data.get("query") or "").strip()
-    top_k = int(data.get("top_k") or 5)
+    try:
+        top_k = int(data["top_k"]) if data.get("top_k") is not None else 5
+    except (TypeError, ValueError):
+        return jsonify({"error": "top_k must be an integer"}), 400
+    if top_k < 1:
+        return jsonify({"error": "top_k must be >= 1"}), 400
+    top_k = min(top_k, _MAX_TOP_K)
     if not query:
         return jsonify({"error": "query is required"}), 400
     vec = get_embedding_for_query(query)
-    results = _index.search(vec, top_k)
+    store = _index
+    results = store.search(vec, top_k)
+    rows = _hydrate(store, [pid for pid, _ in results])
     out = []
     for pid, score in results:
-        row = None
-        try:
-            row = fetch_product(pid)
-        except Exception:
-            row = None
-        if not row:
-            for r in parse_product_rows_from_sql():
-                if int(r.get("id")) == pid:
-                    row = r
-                    break
+        row = rows.get(pid)
         if row:
-            row["_similarity"] = score
-            out.append(row)
+            out.append(dict(row, _similarity=score))
     return jsonify({"results": out, "count": len(out)})
 
 @app.route("/rebuild", methods=["POST"])
@@ -230,26 +278,22 @@ def rebuild():
         products = []
     if not products:
         products = parse_product_rows_from_sql()
-    items = []
-    for p in products:
-        try:
-            if str(p.get("is_deleted")) == "1":
-                continue
-            pid = p.get("productId") or p.get("id")
-            if pid is None:
-                continue
-            vec = get_embedding_for_product(p)
-            items.append((int(pid), vec))
-        except Exception:
-            continue
-    _index.rebuild(items)
-    _index.save()
+    live = [p for p in products if str(p.get("is_deleted")) != "1"]
+    store = FaissIndexStore(dim=_index.dim, size_hint=len(live))
+    for chunk in chunks(sort_by_text_length(live), _EMBED_CHUNK_SIZE):
+        pids, vecs = _embed_rows(chunk)
+        if pids:
+            store.add_batch(pids, vecs)
+    _index.retire()
+    store.save()
+    _warm_products(store)
+    _index = store
     return jsonify({"status": "ok", "index_size": len(_index.mapping)})
 
 @app.route("/health", methods=["GET"])
 def health():
     size = 0
-    if _index and getattr(_index, "mapping", None):
+    if _index is not None:
         size = len(_index.mapping)
     return jsonify({
         "status": "ok",
@@ -259,13 +303,29 @@ def health():
         "error": _index_error,
     })
 
+def _configure_threads():
+    """
+    Pins FAISS (OpenMP) and torch intra-op thread pools so concurrent
+    /search requests don't oversubscribe the cores.
+    FAISS gets every core; torch gets half, leaving room for request threads.
+    Override with FAISS_THREADS / TORCH_THREADS.
+    """
+    import faiss
+    import torch
+    cfg = load_config()
+    ncores = os.cpu_count() or 1
+    faiss.omp_set_num_threads(int(cfg.get("FAISS_THREADS") or ncores))
+    torch.set_num_threads(int(cfg.get("TORCH_THREADS") or max(1, ncores // 2)))
+
 def create_app():
     """
     Returns the Flask app, ensuring index initialization on startup.
     """
+    _configure_threads()
     _init_index_background()
     return app
 
 if __name__ == "__main__":
+    _configure_threads()
     _init_index_background()
     app.run(host="0.0.0.0", port=9990)
@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from urllib.parse import urlparse
 from dotenv import dotenv_values
 
@@ -7,20 +8,36 @@ BASE_DIR = "."
 ENV_PATH = os.path.join(BASE_DIR, ".env")
 DATA_DIR = os.path.join(BASE_DIR, "data")
 INDEX_PATH = os.path.join(DATA_DIR, "products_index.bin")
-MAPPING_PATH = os.path.join(DATA_DIR, "mapping.json")
+MAPPING_PATH = os.path.join(DATA_DIR, "mapping.npy")
+LEGACY_MAPPING_PATH = os.path.join(DATA_DIR, "mapping.json")
+EMBEDDING_CACHE_PATH = os.path.join(DATA_DIR, "embedding_cache.sqlite")
 SQL_DUMP_PATH = os.path.join(BASE_DIR, "product_details.sql")
+PARSED_DUMP_PATH = os.path.join(DATA_DIR, "product_details.jsonl")
 
+@lru_cache(maxsize=1)
 def load_config():
     """
     Loads configuration from OS environment and .env file.
-    Returns a dict with MYSQL_URL if available.
+    Returns a dict with MYSQL_URL and the optional tuning keys if available.
+    Cached for the process lifetime; call load_config.cache_clear() to reload.
     """
     env = {}
     env.update(dotenv_values(ENV_PATH) if os.path.exists(ENV_PATH) else {})
     env.update(os.environ)
     url = env.get("MYSQL_URL") or env.get("DATABASE_URL")
-    return {"MYSQL_URL": url}
+    return {
+        "MYSQL_URL": url,
+        "EMBEDDING_MODEL": env.get("EMBEDDING_MODEL"),
+        "EMBED_SOURCE": env.get("EMBED_SOURCE"),
+        "FAISS_INDEX_TYPE": env.get("FAISS_INDEX_TYPE"),
+        "FAISS_THREADS": env.get("FAISS_THREADS"),
+        "TORCH_THREADS": env.get("TORCH_THREADS"),
+        "FAISS_USE_GPU": env.get("FAISS_USE_GPU"),
+        "EMBEDDING_FP16": env.get("EMBEDDING_FP16"),
+        "EMBEDDING_ONNX_DIR": env.get("EMBEDDING_ONNX_DIR"),
+    }
 
+@lru_cache(maxsize=8)
 def parse_mysql_url(url: str):
     """
     Parses a MySQL URL into connection parameters for mysql-connector-python.
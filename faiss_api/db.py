@@ -1,18 +1,21 @@
 import mysql.connector
-import json
+from mysql.connector import errors, pooling
+import threading
 from typing import Optional, Dict, List
 from .config import load_config, parse_mysql_url
+from .json_utils import loads as json_loads
 
-def get_connection():
-    """
-    Returns a MySQL connection using MYSQL_URL from config.
-    """
+_POOL_SIZE = 16
+_pool = None
+_pool_lock = threading.Lock()
+
+def _connection_params() -> Dict:
     cfg = load_config()
     url = cfg.get("MYSQL_URL")
     if not url:
         raise RuntimeError("MYSQL_URL not set in environment or .env")
     params = parse_mysql_url(url)
-    return mysql.connector.connect(
+    return dict(
         host=params["host"],
         port=params["port"],
         user=params["user"],
@@ -22,9 +25,34 @@ def get_connection():
         autocommit=True,
     )
 
+def _get_pool() -> pooling.MySQLConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name="faiss_api",
+                    pool_size=_POOL_SIZE,
+                    pool_reset_session=True,
+                    **_connection_params(),
+                )
+    return _pool
+
+def get_connection():
+    """
+    Returns a pooled MySQL connection using MYSQL_URL from config.
+    close() hands the connection back to the pool. If every pooled
+    connection is checked out, a direct connection is opened instead.
+    """
+    pool = _get_pool()
+    try:
+        return pool.get_connection()
+    except errors.PoolError:
+        return mysql.connector.connect(**_connection_params())
+
 def _loads(val, fallback):
     try:
-        return json.loads(val) if val else fallback
+        return json_loads(val) if val else fallback
     except Exception:
         return fallback
 
@@ -40,39 +68,76 @@ def _compute_stock(product: Dict, variations: List[Dict]):
     status = "in_stock" if total > 0 else "out_of_stock"
     return total, status
 
+def _format_product(product: Dict, category_name: Optional[str], variations: List[Dict], sub_category_ids: List) -> Dict:
+    """
+    Shapes a raw products row into the full product payload returned by the API.
+    """
+    computed_qty, computed_status = _compute_stock(product, variations)
+    return {
+        "productId": product.get("id"),
+        "name": product.get("name"),
+        "price": float(product.get("price")) if product.get("price") is not None else None,
+        "effective_price": float(product.get("price")) if product.get("price") is not None else None,
+        "discount_price": float(product.get("discount_price")) if product.get("discount_price") is not None else None,
+        "description": product.get("description"),
+        "category_id": product.get("category"),
+        "category": category_name,
+        "sub_category": sub_category_ids,
+        "image_urls": _loads(product.get("image_urls"), []),
+        "videos": _loads(product.get("videos"), []),
+        "rating": float(product.get("rating")) if product.get("rating") is not None else None,
+        "review_count": product.get("review_count"),
+        "highlights": _loads(product.get("highlights"), []),
+        "specifications": _loads(product.get("specifications"), {}),
+        "whats_in_box": _loads(product.get("whats_in_box"), []),
+        "stock_quantity": product.get("stock_quantity"),
+        "stock_status": product.get("stock_status"),
+        "computed_total_stock": computed_qty,
+        "computed_stock_status": computed_status,
+        "is_variable_product": bool(product.get("is_variable_product")),
+        "product_code": product.get("product_code"),
+        "total_sold": product.get("total_sold"),
+        "created_at": product.get("created_at").isoformat() if product.get("created_at") else None,
+        "updated_at": product.get("updated_at").isoformat() if product.get("updated_at") else None,
+        "variations": variations,
+    }
+
 def fetch_product(product_id: int) -> Optional[Dict]:
     conn = get_connection()
     try:
         cur = conn.cursor(dictionary=True)
-        cur.execute("SELECT * FROM products WHERE id = %s AND is_deleted = 0", (product_id,))
-        product = cur.fetchone()
-        if not product:
-            return None
-
-        cur.execute("SELECT name FROM categories WHERE id = %s AND is_deleted = 0", (product.get("category"),))
-        cat_row = cur.fetchone()
-        category_name = (cat_row.get("name") if isinstance(cat_row, dict) else None) if cat_row else None
-
+        # Product, category name and variations in one round-trip; the
+        # product columns repeat once per variation row.
         cur.execute(
             """
-            SELECT v.id, v.variation, v.price, v.quantity,
-                   COALESCE(v.price, p.price) AS effective_price
-            FROM variations v
-            JOIN products p ON p.id = v.product_id
-            WHERE v.product_id = %s
+            SELECT p.*, c.name AS _category_name,
+                   v.id AS _var_id, v.variation AS _var_variation,
+                   v.price AS _var_price, v.quantity AS _var_quantity,
+                   COALESCE(v.price, p.price) AS _var_effective_price
+            FROM products p
+            LEFT JOIN categories c ON c.id = p.category AND c.is_deleted = 0
+            LEFT JOIN variations v ON v.product_id = p.id
+            WHERE p.id = %s AND p.is_deleted = 0
             ORDER BY v.id
             """,
             (product_id,),
         )
-        variations_rows = cur.fetchall() or []
+        joined_rows = cur.fetchall() or []
+        if not joined_rows:
+            return None
+        product = {k: v for k, v in joined_rows[0].items() if not k.startswith("_")}
+        category_name = joined_rows[0].get("_category_name")
+
         formatted_variations = []
-        for v in variations_rows:
+        for v in joined_rows:
+            if v.get("_var_id") is None:
+                continue
             formatted_variations.append({
-                "id": v.get("id") if isinstance(v, dict) else None,
-                "variation": v.get("variation") if isinstance(v, dict) else None,
-                "price": (float(v.get("price")) if isinstance(v, dict) and v.get("price") is not None else None),
-                "effective_price": float(v.get("effective_price")) if isinstance(v, dict) and v.get("effective_price") is not None else None,
-                "quantity": v.get("quantity") if isinstance(v, dict) else None,
+                "id": v.get("_var_id"),
+                "variation": v.get("_var_variation"),
+                "price": float(v.get("_var_price")) if v.get("_var_price") is not None else None,
+                "effective_price": float(v.get("_var_effective_price")) if v.get("_var_effective_price") is not None else None,
+                "quantity": v.get("_var_quantity"),
             })
 
         raw_sub_ids = _loads(product.get("sub_categories"), [])
@@ -93,38 +158,90 @@ def fetch_product(product_id: int) -> Optional[Dict]:
             except Exception:
                 active_sub_ids = raw_sub_ids
 
-        computed_qty, computed_status = _compute_stock(product, formatted_variations)
-
-        formatted_product = {
-            "productId": product.get("id"),
-            "name": product.get("name"),
-            "price": float(product.get("price")) if product.get("price") is not None else None,
-            "effective_price": float(product.get("price")) if product.get("price") is not None else None,
-            "discount_price": float(product.get("discount_price")) if product.get("discount_price") is not None else None,
-            "description": product.get("description"),
-            "category_id": product.get("category"),
-            "category": category_name,
-            "sub_category": active_sub_ids,
-            "image_urls": _loads(product.get("image_urls"), []),
-            "videos": _loads(product.get("videos"), []),
-            "rating": float(product.get("rating")) if product.get("rating") is not None else None,
-            "review_count": product.get("review_count"),
-            "highlights": _loads(product.get("highlights"), []),
-            "specifications": _loads(product.get("specifications"), {}),
-            "whats_in_box": _loads(product.get("whats_in_box"), []),
-            "stock_quantity": product.get("stock_quantity"),
-            "stock_status": product.get("stock_status"),
-            "computed_total_stock": computed_qty,
-            "computed_stock_status": computed_status,
-            "is_variable_product": bool(product.get("is_variable_product")),
-            "product_code": product.get("product_code"),
-            "total_sold": product.get("total_sold"),
-            "created_at": product.get("created_at").isoformat() if product.get("created_at") else None,
-            "updated_at": product.get("updated_at").isoformat() if product.get("updated_at") else None,
-            "variations": formatted_variations,
-        }
-
-        return formatted_product
+        return _format_product(product, category_name, formatted_variations, active_sub_ids)
+    finally:
+        conn.close()
+
+def _format_variation(v: Dict) -> Dict:
+    return {
+        "id": v.get("id"),
+        "variation": v.get("variation"),
+        "price": float(v.get("price")) if v.get("price") is not None else None,
+        "effective_price": float(v.get("effective_price")) if v.get("effective_price") is not None else None,
+        "quantity": v.get("quantity"),
+    }
+
+def fetch_products_bulk(product_ids: List[int]) -> Dict[int, Dict]:
+    """
+    Bulk counterpart of fetch_product: returns {product_id: product} for the
+    given ids in a fixed number of queries (products, variations, sub_categories).
+    Deleted and unknown ids are omitted.
+    """
+    ids = list(dict.fromkeys(int(pid) for pid in product_ids))
+    if not ids:
+        return {}
+    conn = get_connection()
+    try:
+        cur = conn.cursor(dictionary=True)
+        placeholders = ",".join(["%s"] * len(ids))
+        cur.execute(
+            f"""
+            SELECT p.*, c.name AS _category_name
+            FROM products p
+            LEFT JOIN categories c ON c.id = p.category AND c.is_deleted = 0
+            WHERE p.id IN ({placeholders}) AND p.is_deleted = 0
+            """,
+            tuple(ids),
+        )
+        rows = cur.fetchall() or []
+        if not rows:
+            return {}
+        found = [r.get("id") for r in rows]
+
+        placeholders = ",".join(["%s"] * len(found))
+        cur.execute(
+            f"""
+            SELECT v.id, v.product_id, v.variation, v.price, v.quantity,
+                   COALESCE(v.price, p.price) AS effective_price
+            FROM variations v
+            JOIN products p ON p.id = v.product_id
+            WHERE v.product_id IN ({placeholders})
+            ORDER BY v.product_id, v.id
+            """,
+            tuple(found),
+        )
+        vars_by_product: Dict[int, List[Dict]] = {}
+        for v in cur.fetchall() or []:
+            vars_by_product.setdefault(v.get("product_id"), []).append(_format_variation(v))
+
+        raw_subs = {r.get("id"): _loads(r.get("sub_categories"), []) for r in rows}
+        all_sub_ids = list(dict.fromkeys(
+            sid for subs in raw_subs.values() if isinstance(subs, list) for sid in subs
+        ))
+        allowed = None
+        if all_sub_ids:
+            try:
+                placeholders = ",".join(["%s"] * len(all_sub_ids))
+                cur.execute(
+                    f"""
+                    SELECT id FROM sub_categories
+                    WHERE id IN ({placeholders}) AND is_deleted = 0
+                    """,
+                    tuple(all_sub_ids),
+                )
+                allowed = {r["id"] for r in cur.fetchall() or []}
+            except Exception:
+                allowed = None
+
+        out: Dict[int, Dict] = {}
+        for r in rows:
+            pid = r.get("id")
+            subs = raw_subs.get(pid)
+            subs = subs if isinstance(subs, list) else []
+            active_sub_ids = subs if allowed is None else [sid for sid in subs if sid in allowed]
+            product = {k: v for k, v in r.items() if not k.startswith("_")}
+            out[int(pid)] = _format_product(product, r.get("_category_name"), vars_by_product.get(pid, []), active_sub_ids)
+        return out
     finally:
         conn.close()
 
@@ -161,13 +278,7 @@ def fetch_all_products() -> List[Dict]:
                 pid = v.get("product_id") if isinstance(v, dict) else None
                 if pid is None:
                     continue
-                vars_by_product.setdefault(pid, []).append({
-                    "id": v.get("id"),
-                    "variation": v.get("variation"),
-                    "price": float(v.get("price")) if v.get("price") is not None else None,
-                    "effective_price": float(v.get("effective_price")) if v.get("effective_price") is not None else None,
-                    "quantity": v.get("quantity"),
-                })
+                vars_by_product.setdefault(pid, []).append(_format_variation(v))
 
         formatted: List[Dict] = []
         for p in rows:
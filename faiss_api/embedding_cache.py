@@ -0,0 +1,69 @@
+import os
+import sqlite3
+import threading
+import numpy as np
+from typing import Dict, List, Tuple
+from .config import EMBEDDING_CACHE_PATH
+
+# SQLite caps bound parameters per statement (999 on older builds).
+_MAX_VARS = 500
+
+class EmbeddingCache:
+    """
+    Persistent content-hash -> float32 vector cache backed by SQLite.
+    Lets restarts and rebuilds skip the model for products whose content is unchanged.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (hash BLOB PRIMARY KEY, vec BLOB NOT NULL)")
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """
+        Returns {key: vector} for the keys present in the cache.
+        """
+        found: Dict[bytes, np.ndarray] = {}
+        if not keys:
+            return found
+        with self._lock:
+            conn = self._connect()
+            for start in range(0, len(keys), _MAX_VARS):
+                part = keys[start:start + _MAX_VARS]
+                placeholders = ",".join(["?"] * len(part))
+                cur = conn.execute(f"SELECT hash, vec FROM cache WHERE hash IN ({placeholders})", part)
+                for h, vec in cur.fetchall():
+                    found[bytes(h)] = np.frombuffer(vec, dtype=np.float32).copy()
+        return found
+
+    def put_many(self, items: List[Tuple[bytes, np.ndarray]]):
+        """
+        Stores (key, vector) pairs, replacing existing entries.
+        """
+        if not items:
+            return
+        rows = [(k, np.ascontiguousarray(v, dtype=np.float32).tobytes()) for k, v in items]
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO cache (hash, vec) VALUES (?, ?)", rows)
+
+_cache = None
+
+def get_cache() -> EmbeddingCache:
+    """
+    Lazily creates the process-wide embedding cache.
+    """
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache()
+    return _cache
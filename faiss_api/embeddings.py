@@ -1,33 +1,116 @@
+import hashlib
 import json
 import os
-import re
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
 import numpy as np
-from typing import Dict, List
+from typing import Dict, List, Optional
 from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from sentence_transformers import SentenceTransformer
 from .config import load_config
+from .embedding_cache import get_cache
+from .json_utils import loads as json_loads
+from .onnx_encoder import OnnxClipEncoder, has_artifacts
 
 _model = None
+_dim: Optional[int] = None
+
+# Output dims of common sentence-transformers models, so get_embedding_dim
+# needn't load (or run) the model to learn them.
+_KNOWN_DIMS = {
+    "clip-ViT-B-32": 512,
+    "clip-ViT-B-16": 512,
+    "clip-ViT-L-14": 768,
+    "clip-ViT-B-32-multilingual-v1": 512,
+    "all-MiniLM-L6-v2": 384,
+    "all-mpnet-base-v2": 768,
+}
+
+# Batch size handed to SentenceTransformer.encode for product embedding.
+_ENCODE_BATCH_SIZE = 128
+
+# CLIP's input resolution; JPEGs are decoded at the smallest 1/2^k scale that
+# still covers it (the model's own preprocessing then resizes and crops).
+_IMAGE_DRAFT_SIZE = (224, 224)
+
+# Concurrent image downloads per batch; the session pool is sized to match.
+_FETCH_WORKERS = 16
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(total=2, backoff_factor=0.2),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Shared keep-alive session so repeated fetches reuse TCP/TLS connections.
+_session = _make_session()
+_fetch_pool = ThreadPoolExecutor(max_workers=_FETCH_WORKERS, thread_name_prefix="image-fetch")
 
 def get_model():
     """
     Lazily loads and returns a CLIP model for both text and image embeddings.
+    If EMBEDDING_ONNX_DIR holds an exported model (see onnx_encoder.py) and
+    onnxruntime is installed, it runs on ONNX Runtime instead.
+    On CUDA the model runs in fp16 unless EMBEDDING_FP16 is disabled; encoded
+    vectors are cast back to float32 before they reach FAISS.
     """
     global _model
     if _model is None:
-        cfg = load_config()
-        name = cfg.get("MYSQL_URL")  # avoid unused
-        model_name = (cfg.get("EMBEDDING_MODEL") or os.environ.get("EMBEDDING_MODEL") or "clip-ViT-B-32")
-        _model = SentenceTransformer(model_name)
+        _model = _load_onnx_model() or _load_sentence_transformer()
     return _model
 
+def _load_onnx_model():
+    model_dir = load_config().get("EMBEDDING_ONNX_DIR")
+    if not has_artifacts(model_dir):
+        return None
+    try:
+        return OnnxClipEncoder(model_dir)
+    except Exception:
+        return None
+
+def _load_sentence_transformer() -> SentenceTransformer:
+    import torch
+    model = SentenceTransformer(_model_name())
+    if torch.cuda.is_available():
+        model = model.to("cuda")
+        if _fp16_enabled():
+            model = model.half()
+    return model
+
+def _fp16_enabled() -> bool:
+    val = load_config().get("EMBEDDING_FP16")
+    if val is None:
+        return True
+    return str(val).strip().lower() not in ("0", "false", "no", "off")
+
+def _model_name() -> str:
+    cfg = load_config()
+    return cfg.get("EMBEDDING_MODEL") or os.environ.get("EMBEDDING_MODEL") or "clip-ViT-B-32"
+
 def get_embedding_dim() -> int:
     """
-    Returns embedding dimension robustly. Some models may not populate
-    get_sentence_embedding_dimension; fall back to encoding a sample.
+    Returns embedding dimension robustly, from the table of known models
+    first. Some models may not populate get_sentence_embedding_dimension;
+    fall back to encoding a sample. The result is cached for the process.
     """
+    global _dim
+    if _dim is None:
+        name = _model_name()
+        _dim = _KNOWN_DIMS.get(name.split("/")[-1] if name.startswith("sentence-transformers/") else name)
+        if _dim is None:
+            _dim = _probe_embedding_dim()
+    return _dim
+
+def _probe_embedding_dim() -> int:
     model = get_model()
     try:
         dim = model.get_sentence_embedding_dimension()
@@ -42,45 +125,166 @@ def get_embedding_dim() -> int:
         pass
     return 512
 
+def warm_up():
+    """
+    Loads the model and runs small text and image batches so lazy init and
+    kernel warm-up happen before the first real query.
+    """
+    model = get_model()
+    model.encode(["warmup"] * 4, batch_size=4, convert_to_numpy=True, show_progress_bar=False)
+    try:
+        blank = Image.new("RGB", (224, 224))
+        model.encode([blank] * 4, batch_size=4, convert_to_numpy=True, show_progress_bar=False)
+    except Exception:
+        pass  # text-only models
+
 def _normalize(vec: np.ndarray) -> np.ndarray:
     """
     L2-normalizes a vector for cosine similarity via inner product.
+    Model outputs are already normalized inside encode(); this is for
+    vectors produced elsewhere.
+    Scales in place when vec is already contiguous float32.
     """
-    norm = np.linalg.norm(vec)
-    return vec / (norm + 1e-12)
+    vec = np.ascontiguousarray(vec, dtype=np.float32)
+    vec *= 1.0 / (np.sqrt(vec @ vec) + 1e-12)
+    return vec
 
 def _extract_image_urls(row: Dict) -> List[str]:
-    urls = []
     val = row.get("image_urls")
-    if isinstance(val, str) and val.strip():
-        try:
-            parsed = json.loads(val)
-            if isinstance(parsed, list):
-                urls = [u for u in parsed if isinstance(u, str)]
-        except Exception:
-            pass
-    return urls
-
-_url_re = re.compile(r"^https?://", re.IGNORECASE)
+    # Only a JSON array can hold URLs; skip the parser (and its exception) otherwise.
+    if not isinstance(val, str):
+        return []
+    val = val.strip()
+    if len(val) < 2 or val[0] != "[" or val[-1] != "]":
+        return []
+    try:
+        parsed = json_loads(val)
+    except Exception:
+        return []
+    if not isinstance(parsed, list):
+        return []
+    return [u for u in parsed if isinstance(u, str)]
 
 def _is_url(s: str) -> bool:
-    return bool(_url_re.match(s or ""))
+    if not s:
+        return False
+    prefix = s[:8].lower()
+    return prefix.startswith("http://") or prefix.startswith("https://")
 
 def _fetch_image(url: str) -> Image.Image:
-    resp = requests.get(url, timeout=10)
+    resp = _session.get(url, timeout=10)
     resp.raise_for_status()
-    img = Image.open(BytesIO(resp.content)).convert("RGB")
-    return img
+    img = Image.open(BytesIO(resp.content))
+    img.draft("RGB", _IMAGE_DRAFT_SIZE)  # scaled IDCT for JPEGs; no-op for other formats
+    return img.convert("RGB")
+
+def _try_fetch_image(url: str) -> Optional[Image.Image]:
+    try:
+        return _fetch_image(url)
+    except Exception:
+        return None
+
+def _fetch_images(urls: List[str]) -> List[Optional[Image.Image]]:
+    """
+    Fetches many images concurrently; failed fetches come back as None.
+    """
+    if not urls:
+        return []
+    return list(_fetch_pool.map(_try_fetch_image, urls))
 
 def embed_image(img: Image.Image) -> np.ndarray:
     model = get_model()
-    emb = model.encode([img], convert_to_numpy=True, normalize_embeddings=False)[0]
-    return _normalize(emb.astype("float32"))
+    emb = model.encode([img], convert_to_numpy=True, normalize_embeddings=True)[0]
+    return emb.astype("float32", copy=False)
 
 def embed_text(text: str) -> np.ndarray:
     model = get_model()
-    emb = model.encode([text], convert_to_numpy=True, normalize_embeddings=False)[0]
-    return _normalize(emb.astype("float32"))
+    emb = model.encode([text], convert_to_numpy=True, normalize_embeddings=True)[0]
+    return emb.astype("float32", copy=False)
+
+def _encode_batch(items: List) -> np.ndarray:
+    return get_model().encode(
+        items,
+        batch_size=_ENCODE_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    ).astype("float32")
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """
+    Embeds many texts in one encode call; returns an (N, dim) float32 matrix
+    L2-normalized by sentence-transformers.
+    """
+    return _encode_batch(texts)
+
+def embed_images(imgs: List[Image.Image]) -> np.ndarray:
+    """
+    Image counterpart of embed_texts.
+    """
+    return _encode_batch(imgs)
+
+def _embed_source() -> str:
+    cfg = load_config()
+    return (os.environ.get("EMBED_SOURCE") or cfg.get("EMBED_SOURCE") or "auto").lower()
+
+def _product_text(row: Dict) -> str:
+    name = str(row.get("name") or "")
+    desc = str(row.get("description") or "")
+    return (name + " " + desc).strip()
+
+def sort_by_text_length(rows: List[Dict]) -> List[Dict]:
+    """
+    Orders rows by approximate token count of their text so consecutive chunks
+    hold similar lengths and text batches pad only to a chunk-local maximum.
+    (encode() already length-sorts within a call; this extends it across chunks.)
+    """
+    return sorted(rows, key=lambda row: len(_product_text(row).split()))
+
+def _first_reachable_images(rows: List[Dict]) -> List[Optional[Image.Image]]:
+    """
+    Returns the first reachable image of each row (None if none is).
+    Fetches in rounds: every row's first URL concurrently, then the next URL
+    for rows that failed, and so on.
+    """
+    candidates = [_extract_image_urls(row) for row in rows]
+    found: List[Optional[Image.Image]] = [None] * len(rows)
+    todo = [i for i, urls in enumerate(candidates) if urls]
+    attempt = 0
+    while todo:
+        imgs = _fetch_images([candidates[i][attempt] for i in todo])
+        for i, img in zip(todo, imgs):
+            found[i] = img
+        attempt += 1
+        todo = [i for i, img in zip(todo, imgs) if img is None and attempt < len(candidates[i])]
+    return found
+
+def _cache_key(row: Dict, source: str) -> bytes:
+    """
+    Content hash of everything that determines a product's embedding.
+    All image URLs are hashed, not just the first: a later URL is embedded
+    when earlier ones are unreachable.
+    """
+    payload = {
+        "model": _model_name(),
+        "source": source,
+        "text": _product_text(row),
+        "images": _extract_image_urls(row) if source in ("image", "auto") else [],
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+
+def _cache_get(keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+    try:
+        return get_cache().get_many(keys)
+    except Exception:
+        return {}
+
+def _cache_put(items: List) -> None:
+    try:
+        get_cache().put_many(items)
+    except Exception:
+        pass
 
 def get_embedding_for_product(row: Dict) -> np.ndarray:
     """
@@ -88,33 +292,87 @@ def get_embedding_for_product(row: Dict) -> np.ndarray:
     - Source selection via EMBED_SOURCE env (image|text|auto, default auto)
     - If image: embed first reachable image
     - Otherwise: embed name + description as text
+    Results are cached on disk by content hash.
     """
-    cfg = load_config()
-    mode = (cfg.get("EMBEDDING_MODEL") and None)  # noop to satisfy lints
-    source = (os.environ.get("EMBED_SOURCE") or cfg.get("EMBED_SOURCE") or "auto").lower()
-    urls = _extract_image_urls(row)
-    if source in ("image", "auto") and urls:
-        for u in urls:
-            try:
-                img = _fetch_image(u)
-                return embed_image(img)
-            except Exception:
-                continue
-    name = str(row.get("name") or "")
-    desc = str(row.get("description") or "")
-    text = (name + " " + desc).strip()
-    return embed_text(text)
+    return get_embeddings_for_products([row])[0]
+
+def get_embeddings_for_products(rows: List[Dict]) -> np.ndarray:
+    """
+    Batched counterpart of get_embedding_for_product.
+    Groups rows by modality (image vs text) and runs one model.encode per group
+    (embed_images / embed_texts); rows whose images all fail to fetch fall
+    back to the text batch.
+    Returns an (N, dim) float32 matrix of L2-normalized vectors aligned with rows.
+    Rows whose content hash is in the embedding cache skip the model entirely.
+    Text fallbacks for rows that have image URLs are not cached, so a
+    transient fetch failure is retried on the next build.
+    """
+    source = _embed_source()
+    keys = [_cache_key(row, source) for row in rows]
+    cached = _cache_get(keys)
+    misses = [i for i, key in enumerate(keys) if key not in cached]
+    fetched = (
+        _first_reachable_images([rows[i] for i in misses])
+        if source in ("image", "auto")
+        else [None] * len(misses)
+    )
+    images, image_idx = [], []
+    texts, text_idx = [], []
+    uncacheable = set()
+    for i, img in zip(misses, fetched):
+        row = rows[i]
+        if img is not None:
+            images.append(img)
+            image_idx.append(i)
+        else:
+            texts.append(_product_text(row))
+            text_idx.append(i)
+            if source in ("image", "auto") and _extract_image_urls(row):
+                uncacheable.add(i)
+
+    dim = next(iter(cached.values())).shape[0] if cached else None
+    out: Optional[np.ndarray] = None
+    if dim is not None:
+        out = np.empty((len(rows), dim), dtype="float32")
+        for i, key in enumerate(keys):
+            if key in cached:
+                out[i] = cached[key]
+
+    fresh = []
+    for embed, items, idx in ((embed_images, images, image_idx), (embed_texts, texts, text_idx)):
+        if not items:
+            continue
+        vecs = embed(items)
+        if out is None:
+            out = np.empty((len(rows), vecs.shape[1]), dtype="float32")
+        out[idx] = vecs
+        fresh.extend((keys[i], v) for i, v in zip(idx, vecs) if i not in uncacheable)
+    _cache_put(fresh)
+    if out is None:
+        return np.empty((0, get_embedding_dim()), dtype="float32")
+    return out
+
+@lru_cache(maxsize=4096)
+def _cached_query_embedding(q: str, is_image: bool) -> bytes:
+    """
+    Memoizes query embeddings as immutable bytes; failed image fetches raise
+    and are therefore not cached.
+    """
+    if is_image:
+        return embed_image(_fetch_image(q)).tobytes()
+    return embed_text(q).tobytes()
 
 def get_embedding_for_query(query: str) -> np.ndarray:
     """
     Generates an embedding for a query (image URL or text).
     If the query looks like a URL, treat it as an image and embed the pixels.
+    Repeated queries are served from an in-process LRU cache.
     """
     q = query.strip()
     if _is_url(q):
         try:
-            img = _fetch_image(q)
-            return embed_image(img)
+            return np.frombuffer(_cached_query_embedding(q, True), dtype=np.float32).copy()
         except Exception:
             pass
-    return embed_text(q)
+    # CLIP's tokenizer is case-insensitive, so lowercasing only improves hit rate.
+    return np.frombuffer(_cached_query_embedding(q.lower(), False), dtype=np.float32).copy()
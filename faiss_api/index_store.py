@@ -1,74 +1,553 @@
+import atexit
 import os
 import json
+import math
+import threading
+import time
+import weakref
 import faiss
 import numpy as np
-from typing import List, Tuple, Dict
-from .config import INDEX_PATH, MAPPING_PATH, DATA_DIR
+from typing import List, Tuple, Dict, Optional
+from .config import INDEX_PATH, MAPPING_PATH, LEGACY_MAPPING_PATH, DATA_DIR, load_config
+
+# HNSW graph parameters (FAISS_INDEX_TYPE=hnsw)
+_HNSW_M = 32
+_HNSW_EF_CONSTRUCTION = 200
+_HNSW_EF_SEARCH = 64
+
+# Vectors buffered to train quantized indexes (FAISS_INDEX_TYPE=sq8|hnsw_sq8|ivf)
+_TRAIN_SIZE = 10_000
+
+# IVF parameters (FAISS_INDEX_TYPE=ivf|ivf_sqfp16, or auto above _IVF_MIN_SIZE products):
+# nlist ~ sqrt(N) with an HNSW coarse quantizer; k-means wants ~39 points per list.
+_IVF_MIN_SIZE = 50_000
+_IVF_NPROBE = 8
+_IVF_MIN_POINTS_PER_LIST = 39
+
+# Inverted-file types and the encoding of their lists (index_factory suffix).
+_IVF_ENCODINGS = {"ivf": "Flat", "ivf_sqfp16": "SQfp16"}
+
+# Zero-copy mmap of the persisted codes (IO_FLAG_MMAP_IFC, faiss >= 1.10),
+# IVF inverted lists included; plain IO_FLAG_MMAP only keeps IVF lists on disk.
+# (IO_FLAG_ONDISK_SAME_DIR is only for lists stored in a separate .ivfdata.)
+_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# Initial capacity of the mapping array; it doubles when full.
+_MAPPING_MIN_CAPACITY = 1024
+
+# Minimum delay before a background save, so bursts of mutations coalesce.
+_SAVE_DEBOUNCE_SECONDS = 1.0
+
+# Serializes writers of the index files (background savers, explicit saves and
+# the exit flush), which share the same .tmp paths.
+_save_lock = threading.Lock()
+
+# How long a search waits for concurrent queries to join its batch; only
+# applied while traffic is concurrent (the previous batch held >1 query).
+_SEARCH_BATCH_WINDOW_SECONDS = 0.005
+
+# Smallest query batch sent to the GPU replica (FAISS_USE_GPU=1); below it the
+# host-to-device copy outweighs the faster scan, so the CPU index answers.
+_GPU_MIN_BATCH = 16
+
+_gpu_resources = None
+
+def _gpu_available() -> bool:
+    val = load_config().get("FAISS_USE_GPU")
+    if str(val or "").strip().lower() not in ("1", "true", "yes", "on"):
+        return False
+    return hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0
+
+def _get_gpu_resources():
+    global _gpu_resources
+    if _gpu_resources is None:
+        _gpu_resources = faiss.StandardGpuResources()
+    return _gpu_resources
+
+# Stores with background saves scheduled; flushed at interpreter exit because
+# the daemon saver thread would otherwise be killed mid-debounce.
+_live_stores: "weakref.WeakSet[FaissIndexStore]" = weakref.WeakSet()
+
+def _save_pending_on_exit():
+    for store in list(_live_stores):
+        if store._dirty and not store._retired:
+            try:
+                store.save()
+            except Exception:
+                pass
+
+atexit.register(_save_pending_on_exit)
+
+def _sq_suffix(sq: faiss.ScalarQuantizer) -> Optional[str]:
+    return {faiss.ScalarQuantizer.QT_8bit: "sq8", faiss.ScalarQuantizer.QT_fp16: "sqfp16"}.get(sq.qtype)
+
+def _index_type_of(idx: faiss.Index) -> Optional[str]:
+    """
+    Maps a loaded index back to its FAISS_INDEX_TYPE name (None if unknown),
+    so mutations and rebuilds keep the type the file was built with.
+    """
+    if isinstance(idx, faiss.IndexIVFScalarQuantizer):
+        return "ivf_sqfp16" if _sq_suffix(idx.sq) == "sqfp16" else None
+    if isinstance(idx, faiss.IndexIVFFlat):
+        return "ivf"
+    if not isinstance(idx, faiss.IndexIDMap2):
+        return None
+    base = faiss.downcast_index(idx.index)
+    if isinstance(base, faiss.IndexHNSWFlat):
+        return "hnsw"
+    if isinstance(base, faiss.IndexHNSWSQ):
+        suffix = _sq_suffix(faiss.downcast_index(base.storage).sq)
+        return "hnsw_" + suffix if suffix else None
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        return _sq_suffix(base.sq)
+    if isinstance(base, faiss.IndexFlatIP):
+        return "flat"
+    return None
+
+def _ivf_nlist(n: int) -> int:
+    return max(1, min(int(math.sqrt(n)), n // _IVF_MIN_POINTS_PER_LIST))
 
 class FaissIndexStore:
     """
-    Manages FAISS index and mapping (faiss_id -> product_id) persistence.
-    Vectors are not persisted separately; deletes trigger index rebuild from source rows.
+    Manages FAISS index and mapping (int64 array of indexed product_ids) persistence.
+    FAISS ids are product ids (an IndexIDMap2, or the native ids of an IVF
+    index), so single products can be removed in place without re-embedding
+    the catalog.
+    FAISS_INDEX_TYPE selects the underlying index: "flat" (exact), "hnsw"
+    (approximate, sub-linear search for large catalogs), "ivf" (inverted
+    lists, nlist ~ sqrt(size_hint), nprobe=8), the fp16 scalar-quantized
+    "sqfp16" / "hnsw_sqfp16" / "ivf_sqfp16" (half the memory and scan
+    bandwidth, no training), the 8-bit "sq8" / "hnsw_sq8" (4x less memory),
+    or "auto" (default: flat, or ivf_sqfp16 once size_hint exceeds 50k
+    products). Trained types buffer the first vectors added until there are
+    enough to train on.
+    With FAISS_USE_GPU=1 and a GPU build of FAISS, large query batches are
+    served from a GPU copy of the index; the CPU index stays authoritative
+    (mutations, saves) and the copy is rebuilt lazily after changes.
     """
 
-    def __init__(self, dim: int):
+    def __init__(self, dim: int, index_type: Optional[str] = None, size_hint: int = 0):
         self.dim = dim
-        self.index = faiss.IndexFlatIP(dim)
-        self.mapping: List[int] = []
+        self.index_type = (index_type or load_config().get("FAISS_INDEX_TYPE") or "auto").lower()
+        if self.index_type == "auto":
+            self.index_type = "ivf_sqfp16" if size_hint > _IVF_MIN_SIZE else "flat"
+        self._nlist = _ivf_nlist(max(size_hint, _IVF_MIN_SIZE))
+        self.index = self._new_index()
+        self._mapping_buf = np.empty(0, dtype="int64")
+        self._mapping_size = 0
+        # product_id -> full product row served by /search; kept in sync by the API
+        self.products: Dict[int, Dict] = {}
+        self._readonly = False
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._retired = False
+        self._save_event = threading.Event()
+        self._saver = None
+        self._last_save_seconds = 0.0
+        self._pending: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._coalescer = _SearchCoalescer(self)
+        self._use_gpu = _gpu_available()
+        self._gpu_index = None
+
+    @property
+    def mapping(self) -> np.ndarray:
+        """
+        Indexed product ids, in insertion order (a view; do not mutate).
+        """
+        return self._mapping_buf[:self._mapping_size]
+
+    def _set_mapping(self, ids: np.ndarray):
+        self._mapping_buf = np.asarray(ids, dtype="int64")
+        self._mapping_size = len(self._mapping_buf)
+
+    def _append_mapping(self, ids: np.ndarray):
+        need = self._mapping_size + len(ids)
+        if need > len(self._mapping_buf):
+            cap = max(need, 2 * len(self._mapping_buf), _MAPPING_MIN_CAPACITY)
+            buf = np.empty(cap, dtype="int64")
+            buf[:self._mapping_size] = self.mapping
+            self._mapping_buf = buf
+        self._mapping_buf[self._mapping_size:need] = ids
+        self._mapping_size = need
+
+    def _is_ivf(self) -> bool:
+        return self.index_type in _IVF_ENCODINGS
+
+    def _train_size(self) -> int:
+        if self._is_ivf():
+            return max(_TRAIN_SIZE, self._nlist * _IVF_MIN_POINTS_PER_LIST)
+        return _TRAIN_SIZE
+
+    def _new_index(self) -> faiss.Index:
+        if self._is_ivf():
+            # IVF keeps ids itself; the hashtable direct map enables remove_ids.
+            spec = f"IVF{self._nlist}_HNSW32,{_IVF_ENCODINGS[self.index_type]}"
+            index = faiss.index_factory(self.dim, spec, faiss.METRIC_INNER_PRODUCT)
+            index.nprobe = _IVF_NPROBE
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+            return index
+        qt8, qt16 = faiss.ScalarQuantizer.QT_8bit, faiss.ScalarQuantizer.QT_fp16
+        if self.index_type == "hnsw":
+            base = faiss.IndexHNSWFlat(self.dim, _HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        elif self.index_type == "hnsw_sq8":
+            base = faiss.IndexHNSWSQ(self.dim, qt8, _HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        elif self.index_type == "hnsw_sqfp16":
+            base = faiss.IndexHNSWSQ(self.dim, qt16, _HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        elif self.index_type == "sq8":
+            base = faiss.IndexScalarQuantizer(self.dim, qt8, faiss.METRIC_INNER_PRODUCT)
+        elif self.index_type == "sqfp16":
+            base = faiss.IndexScalarQuantizer(self.dim, qt16, faiss.METRIC_INNER_PRODUCT)
+        else:
+            base = faiss.IndexFlatIP(self.dim)
+        if self.index_type in ("hnsw", "hnsw_sq8", "hnsw_sqfp16"):
+            base.hnsw.efConstruction = _HNSW_EF_CONSTRUCTION
+            base.hnsw.efSearch = _HNSW_EF_SEARCH
+        return faiss.IndexIDMap2(base)
+
+    @staticmethod
+    def _prepare(vectors: np.ndarray) -> np.ndarray:
+        """
+        Returns a C-contiguous float32 copy, L2-normalized row-wise by FAISS.
+        """
+        vecs = np.array(vectors, dtype="float32", order="C", ndmin=2)
+        faiss.normalize_L2(vecs)
+        return vecs
+
+    @staticmethod
+    def _add_to(index: faiss.Index, vecs: np.ndarray, ids: np.ndarray):
+        if not index.is_trained:
+            index.train(vecs)
+        index.add_with_ids(vecs, ids)
+
+    def flush(self):
+        """
+        Trains the index on any buffered vectors and adds them.
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            vecs = np.concatenate([v for v, _ in self._pending], axis=0)
+            ids = np.concatenate([i for _, i in self._pending], axis=0)
+            self._pending = []
+            self._ensure_writable()
+            if self._is_ivf() and not self.index.is_trained and len(ids) < self._train_size():
+                # Fewer products than size_hint promised; shrink nlist to fit.
+                self._nlist = _ivf_nlist(len(ids))
+                self.index = self._new_index()
+            self._add_to(self.index, vecs, ids)
+            self._append_mapping(ids)
+            self._mark_changed()
+
+    def _mark_changed(self):
+        self._dirty = True
+        self._gpu_index = None
+
+    def _gpu_replica(self) -> Optional[faiss.Index]:
+        """
+        Returns a GPU copy of the current index, or None if it can't be made
+        (e.g. HNSW has no GPU implementation).
+        """
+        with self._lock:
+            if self._gpu_index is None:
+                try:
+                    self._gpu_index = faiss.index_cpu_to_gpu(_get_gpu_resources(), 0, self.index)
+                except Exception:
+                    self._use_gpu = False
+            return self._gpu_index
+
+    def _ensure_writable(self):
+        """
+        Copies a memory-mapped index and mapping into owned memory before they
+        are mutated; FAISS aborts the process on writes to a viewed (mmapped)
+        buffer.
+        """
+        if self._readonly:
+            self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            self._set_mapping(np.array(self.mapping))
+            self._readonly = False
 
     def save(self):
         """
-        Persists the FAISS index (.bin) and mapping.json.
+        Persists the FAISS index (.bin) and mapping (.npy).
+        Files are written to .tmp siblings and atomically renamed into place,
+        so readers (including a memory-mapped index) never see a partial file.
+        Retired stores never write, so a late save can't clobber their successor.
+        """
+        started = time.monotonic()
+        self.flush()
+        with self._lock:
+            data = faiss.serialize_index(self.index)
+            mapping = self.mapping.copy()
+            self._dirty = False
+        with _save_lock:
+            if self._retired:
+                return
+            os.makedirs(DATA_DIR, exist_ok=True)
+            tmp_index, tmp_mapping = INDEX_PATH + ".tmp", MAPPING_PATH + ".tmp"
+            data.tofile(tmp_index)
+            with open(tmp_mapping, "wb") as f:
+                np.save(f, mapping)
+            os.replace(tmp_index, INDEX_PATH)
+            os.replace(tmp_mapping, MAPPING_PATH)
+        self._last_save_seconds = time.monotonic() - started
+
+    def save_async(self):
+        """
+        Schedules a debounced background save and returns immediately.
+        Requests coalesce into a single pending save (the dirty flag plus one
+        wake-up event), however many arrive during the debounce; anything
+        still pending is saved at interpreter exit.
+        """
+        with self._lock:
+            self._dirty = True
+            _live_stores.add(self)
+            if self._saver is None:
+                self._saver = threading.Thread(target=self._save_loop, daemon=True)
+                self._saver.start()
+        self._save_event.set()
+
+    def retire(self):
+        """
+        Drops pending background saves; used when this store is replaced so a
+        late save cannot overwrite the newer index on disk.
         """
-        os.makedirs(DATA_DIR, exist_ok=True)
-        faiss.write_index(self.index, INDEX_PATH)
-        with open(MAPPING_PATH, "w", encoding="utf-8") as f:
-            json.dump(self.mapping, f)
+        self._retired = True
+        self._save_event.set()
+
+    def _save_loop(self):
+        while not self._retired:
+            self._save_event.wait()
+            time.sleep(max(_SAVE_DEBOUNCE_SECONDS, self._last_save_seconds))
+            self._save_event.clear()
+            if self._dirty and not self._retired:
+                try:
+                    self.save()
+                except Exception:
+                    pass
 
     def load_if_exists(self) -> bool:
         """
         Loads persisted index and mapping if both exist and match current dim.
+        The index and mapping.npy are memory-mapped read-only so startup is
+        lazy; they are copied into memory on first mutation.
+        Older positional IndexFlatIP files are migrated to an IndexIDMap2, and
+        a legacy mapping.json is read when mapping.npy is absent.
+        nprobe is stored in IVF index files, so it survives the round trip;
+        the index type is taken from the file rather than FAISS_INDEX_TYPE.
         """
-        if not (os.path.exists(INDEX_PATH) and os.path.exists(MAPPING_PATH)):
+        if not os.path.exists(INDEX_PATH):
+            return False
+        if os.path.exists(MAPPING_PATH):
+            mapping = np.load(MAPPING_PATH, mmap_mode="r")
+        elif os.path.exists(LEGACY_MAPPING_PATH):
+            with open(LEGACY_MAPPING_PATH, "r", encoding="utf-8") as f:
+                mapping = np.asarray(json.load(f), dtype="int64")
+        else:
             return False
-        idx = faiss.read_index(INDEX_PATH)
+        try:
+            idx, readonly = faiss.read_index(INDEX_PATH, _MMAP_FLAGS), True
+        except RuntimeError:
+            idx, readonly = faiss.read_index(INDEX_PATH), False
         if idx.d != self.dim:
             return False
+        loaded_type = _index_type_of(idx)
+        if loaded_type is not None:
+            self.index_type = loaded_type
+            if self._is_ivf():
+                self._nlist = faiss.extract_index_ivf(idx).nlist
+        elif not isinstance(idx, (faiss.IndexIDMap2, faiss.IndexIVF)):
+            if idx.ntotal != len(mapping):
+                return False
+            vecs = idx.reconstruct_n(0, idx.ntotal)
+            idx, readonly = self._new_index(), False
+            if len(mapping):
+                self._add_to(idx, vecs, mapping)
         self.index = idx
-        with open(MAPPING_PATH, "r", encoding="utf-8") as f:
-            self.mapping = json.load(f)
+        self._readonly = readonly
+        self._set_mapping(mapping if readonly else np.array(mapping))
         return True
 
     def rebuild(self, items: List[Tuple[int, np.ndarray]]):
         """
         Rebuilds the index from (product_id, vector) items.
         """
-        self.index = faiss.IndexFlatIP(self.dim)
-        self.mapping = []
+        if self._is_ivf():
+            self._nlist = _ivf_nlist(len(items))
+        index = self._new_index()
+        ids = np.empty(0, dtype="int64")
         if items:
-            vecs = np.stack([v for _, v in items], axis=0).astype("float32")
-            self.index.add(vecs)
-            self.mapping = [pid for pid, _ in items]
+            # Fill one preallocated buffer instead of np.stack + a float32 copy.
+            vecs = np.empty((len(items), self.dim), dtype="float32")
+            ids = np.empty(len(items), dtype="int64")
+            for i, (pid, v) in enumerate(items):
+                vecs[i] = v
+                ids[i] = pid
+            faiss.normalize_L2(vecs)
+            self._add_to(index, vecs, ids)
+        with self._lock:
+            self.index = index
+            self._set_mapping(ids)
+            self._pending = []
+            self._readonly = False
+            self._mark_changed()
 
     def add(self, product_id: int, vector: np.ndarray):
         """
         Adds a product to the index.
         """
-        self.index.add(vector.reshape(1, -1).astype("float32"))
-        self.mapping.append(product_id)
+        self.add_batch([product_id], vector.reshape(1, -1))
+
+    def add_batch(self, product_ids: List[int], vectors: np.ndarray):
+        """
+        Adds many products to the index in a single FAISS call
+        (add_with_ids on an (N, dim) matrix, normalized with faiss.normalize_L2).
+        """
+        if len(product_ids) == 0:
+            return
+        vecs = self._prepare(vectors)
+        ids = np.asarray(product_ids, dtype="int64")
+        with self._lock:
+            if not self.index.is_trained:
+                # Quantized indexes need training data; buffer until we have enough.
+                self._pending.append((vecs, ids))
+                if sum(len(i) for _, i in self._pending) >= self._train_size():
+                    self.flush()
+                return
+            self._ensure_writable()
+            self.index.add_with_ids(vecs, ids)
+            self._append_mapping(ids)
+            self._mark_changed()
+
+    def remove(self, product_id: int) -> int:
+        """
+        Removes a product from the index via FAISS remove_ids.
+        Returns the number of vectors removed.
+        """
+        with self._lock:
+            self.flush()
+            self._ensure_writable()
+            try:
+                removed = int(self.index.remove_ids(np.asarray([product_id], dtype="int64")))
+            except RuntimeError:
+                # HNSW graphs don't support deletion; rebuild from the stored vectors.
+                removed = self._rebuild_without(product_id)
+            self._set_mapping(self.mapping[self.mapping != product_id])
+            self._mark_changed()
+            return removed
+
+    def _rebuild_without(self, product_id: int) -> int:
+        ids = faiss.vector_to_array(self.index.id_map)
+        keep = ids != product_id
+        vecs = self.index.index.reconstruct_n(0, self.index.ntotal)
+        index = self._new_index()
+        if keep.any():
+            self._add_to(index, vecs[keep], ids[keep])
+        self.index = index
+        return int((~keep).sum())
 
     def search(self, vector: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
         """
         Searches the index and returns [(product_id, score), ...].
+        Concurrent calls are coalesced into one search_batch call.
+        top_k must be >= 1 and is capped at the index size.
         """
+        if top_k < 1:
+            raise ValueError("top_k must be >= 1")
         if len(self.mapping) == 0:
             return []
-        D, I = self.index.search(vector.reshape(1, -1).astype("float32"), top_k)
+        return self._coalescer.search(vector, min(int(top_k), len(self.mapping)))
+
+    def search_batch(self, vectors: np.ndarray, top_k: int) -> List[List[Tuple[int, float]]]:
+        """
+        Searches many queries in one FAISS call (which, unlike nq=1, runs
+        multi-threaded) and returns one [(product_id, score), ...] per query.
+        """
+        queries = np.ascontiguousarray(vectors, dtype="float32")  # no copy if already float32
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+        if len(self.mapping) == 0:
+            return [[] for _ in range(len(queries))]
+        index = self.index
+        if self._use_gpu and len(queries) >= _GPU_MIN_BATCH:
+            index = self._gpu_replica() or index
+        D, I = index.search(queries, top_k)
         results = []
-        for score, idx in zip(D[0], I[0]):
-            if idx == -1:
-                continue
-            pid = self.mapping[idx]
-            results.append((pid, float(score)))
+        for q in range(len(queries)):
+            hit = I[q] != -1
+            results.append(list(zip(I[q][hit].tolist(), D[q][hit].tolist())))
         return results
 
+class _SearchSlot:
+    __slots__ = ("vector", "top_k", "result", "error", "done")
+
+    def __init__(self, vector: np.ndarray, top_k: int):
+        self.vector = vector
+        self.top_k = top_k
+        self.result: List[Tuple[int, float]] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+
+class _SearchCoalescer:
+    """
+    Groups concurrent single-query searches into batches.
+    The first caller to find no batch running becomes the leader: it
+    collects every queued query and runs them through one search_batch.
+    Callers arriving meanwhile queue up for the next leader, so batches
+    form under load without delaying an idle server.
+    Queries are copied into a reusable (batch, dim) buffer; only the
+    current leader touches it.
+    """
+
+    def __init__(self, store: "FaissIndexStore"):
+        self._store = store
+        self._cond = threading.Condition()
+        self._queue: List[_SearchSlot] = []
+        self._busy = False
+        self._last_batch_size = 0
+        self._qbuf = np.empty((0, store.dim), dtype="float32")
+
+    def search(self, vector: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        slot = _SearchSlot(vector, top_k)
+        with self._cond:
+            self._queue.append(slot)
+            while self._busy and not slot.done:
+                self._cond.wait()
+            if not slot.done:
+                self._busy = True
+        if not slot.done:
+            try:
+                self._lead()
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+        if slot.error is not None:
+            raise slot.error
+        return slot.result
+
+    def _lead(self):
+        if self._last_batch_size > 1:
+            time.sleep(_SEARCH_BATCH_WINDOW_SECONDS)
+        with self._cond:
+            batch, self._queue = self._queue, []
+        self._last_batch_size = len(batch)
+        if len(self._qbuf) < len(batch):
+            self._qbuf = np.empty((max(len(batch), 2 * len(self._qbuf)), self._store.dim), dtype="float32")
+        # A malformed query fails only its own slot, not the whole batch.
+        valid: List[_SearchSlot] = []
+        for s in batch:
+            try:
+                self._qbuf[len(valid)] = s.vector
+                valid.append(s)
+            except Exception as e:
+                s.error = e
+        if valid:
+            try:
+                results = self._store.search_batch(self._qbuf[:len(valid)], max(s.top_k for s in valid))
+                for s, res in zip(valid, results):
+                    s.result = res[:s.top_k]
+            except Exception as e:
+                for s in valid:
+                    s.error = e
+        for s in batch:
+            s.done = True
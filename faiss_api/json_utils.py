@@ -0,0 +1,36 @@
+import json
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # stdlib json fallback
+    orjson = None
+
+def loads(val):
+    """
+    Parses JSON text with orjson when available, else stdlib json.
+    """
+    if orjson is not None:
+        return orjson.loads(val)
+    return json.loads(val)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson. Falls back to the default provider
+    when orjson is missing or for pretty-printed output (indent), which orjson
+    can't match. Dates still go through Flask's default() for identical output.
+    """
+
+    def dumps(self, obj, **kwargs):
+        kwargs.pop("separators", None)  # orjson output is always compact
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
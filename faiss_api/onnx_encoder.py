@@ -0,0 +1,138 @@
+"""
+Optional ONNX Runtime backend for CLIP embeddings.
+
+Export the configured model once:
+    python -m faiss_api.onnx_encoder ./data/onnx
+then set EMBEDDING_ONNX_DIR=./data/onnx. Without the directory (or without
+onnxruntime installed) embeddings fall back to SentenceTransformer.
+"""
+import os
+import sys
+from typing import List, Optional
+import faiss
+import numpy as np
+
+TEXT_GRAPH = "text.onnx"
+VISION_GRAPH = "vision.onnx"
+_OPSET = 17
+
+def has_artifacts(model_dir: Optional[str]) -> bool:
+    return bool(model_dir) and all(
+        os.path.exists(os.path.join(model_dir, name)) for name in (TEXT_GRAPH, VISION_GRAPH)
+    )
+
+class OnnxClipEncoder:
+    """
+    Implements the part of SentenceTransformer's API used by embeddings.py
+    (encode, get_sentence_embedding_dimension) on exported CLIP text and
+    vision graphs.
+    """
+
+    def __init__(self, model_dir: str):
+        import onnxruntime as ort
+        from transformers import CLIPProcessor
+        available = ort.get_available_providers()
+        providers = [p for p in ("CUDAExecutionProvider", "CPUExecutionProvider") if p in available]
+        self.processor = CLIPProcessor.from_pretrained(model_dir)
+        self.text = ort.InferenceSession(os.path.join(model_dir, TEXT_GRAPH), providers=providers)
+        self.vision = ort.InferenceSession(os.path.join(model_dir, VISION_GRAPH), providers=providers)
+        self.dim = int(self.text.get_outputs()[0].shape[-1])
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _run_text(self, texts: List[str]) -> np.ndarray:
+        enc = self.processor(text=texts, padding=True, truncation=True, return_tensors="np")
+        feeds = {
+            "input_ids": enc["input_ids"].astype("int64"),
+            "attention_mask": enc["attention_mask"].astype("int64"),
+        }
+        return self.text.run(None, feeds)[0]
+
+    def _run_images(self, images: List) -> np.ndarray:
+        pixels = self.processor(images=images, return_tensors="np")["pixel_values"]
+        return self.vision.run(None, {"pixel_values": pixels.astype("float32")})[0]
+
+    def encode(
+        self,
+        items: List,
+        batch_size: int = 32,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+        show_progress_bar: bool = False,
+    ) -> np.ndarray:
+        out = np.empty((len(items), self.dim), dtype="float32")
+        text_idx = [i for i, item in enumerate(items) if isinstance(item, str)]
+        image_idx = [i for i, item in enumerate(items) if not isinstance(item, str)]
+        for run, idx in ((self._run_text, text_idx), (self._run_images, image_idx)):
+            for start in range(0, len(idx), batch_size):
+                chunk = idx[start:start + batch_size]
+                out[chunk] = run([items[i] for i in chunk])
+        if normalize_embeddings:
+            faiss.normalize_L2(out)
+        return out
+
+def _features(output):
+    # transformers >= 5 returns a model output instead of a bare tensor
+    return output if not hasattr(output, "pooler_output") else output.pooler_output
+
+def export(model_name: str, out_dir: str):
+    """
+    Exports a SentenceTransformer CLIP model's text and vision towers
+    (projection included) plus its processor files into out_dir.
+    """
+    import torch
+    from PIL import Image
+    from sentence_transformers import SentenceTransformer
+
+    module = SentenceTransformer(model_name, device="cpu")[0]
+    clip = getattr(module, "auto_model", None) or module.model
+    processor = module.processor
+    clip.eval()
+
+    # clip is registered as a submodule so its weights export as initializers
+    class TextTower(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, input_ids, attention_mask):
+            return _features(self.clip.get_text_features(input_ids=input_ids, attention_mask=attention_mask))
+
+    class VisionTower(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, pixel_values):
+            return _features(self.clip.get_image_features(pixel_values=pixel_values))
+
+    os.makedirs(out_dir, exist_ok=True)
+    text = processor(text=["a photo of a product"], padding=True, return_tensors="pt")
+    pixels = processor(images=[Image.new("RGB", (224, 224))], return_tensors="pt")["pixel_values"]
+    with torch.no_grad():
+        torch.onnx.export(
+            TextTower(),
+            (text["input_ids"], text["attention_mask"]),
+            os.path.join(out_dir, TEXT_GRAPH),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["embeddings"],
+            dynamic_axes={"input_ids": {0: "batch", 1: "seq"}, "attention_mask": {0: "batch", 1: "seq"}, "embeddings": {0: "batch"}},
+            opset_version=_OPSET,
+            dynamo=False,
+        )
+        torch.onnx.export(
+            VisionTower(),
+            (pixels,),
+            os.path.join(out_dir, VISION_GRAPH),
+            input_names=["pixel_values"],
+            output_names=["embeddings"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "embeddings": {0: "batch"}},
+            opset_version=_OPSET,
+            dynamo=False,
+        )
+    processor.save_pretrained(out_dir)
+
+if __name__ == "__main__":
+    from .embeddings import _model_name
+    export(_model_name(), sys.argv[1] if len(sys.argv) > 1 else os.path.join("data", "onnx"))
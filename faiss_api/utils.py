@@ -1,39 +1,95 @@
 import os
 import re
-from typing import List, Dict
-from .config import SQL_DUMP_PATH
+import json
+import tempfile
+from functools import lru_cache
+from typing import List, Dict, Iterator, Optional, Sequence
+from .config import SQL_DUMP_PATH, PARSED_DUMP_PATH, DATA_DIR
+
+_INSERT_RE = re.compile(r"INSERT INTO `products` \((.*?)\) VALUES (.*);$")
+
+# One SQL literal (quoted string, 0x hex, NULL or number), any other bare word
+# (e.g. TRUE, _binary), or a tuple paren. Only commas and whitespace are
+# skipped by findall: a bare word is kept verbatim (as the character-level
+# splitter would), and one that splits a value (e.g. _binary 'x') breaks the
+# column count, sending the statement to that fallback.
+_SQL_TOKEN_RE = re.compile(
+    r"'[^'\\]*(?:\\.[^'\\]*)*'|0x[0-9A-Fa-f]+\b|\bNULL\b|-?\d[\d.eE+-]*|[^\s,()]+|[()]",
+    re.IGNORECASE,
+)
+
+# Fallback splitters: one comma-separated field (quoted strings may contain
+# commas; a backslash escapes the next character), and the quoted strings,
+# escapes and parens that delimit tuples. An unterminated quote runs to the end.
+_SQL_FIELD_RE = re.compile(r"(?:'[^'\\]*(?:\\.[^'\\]*)*'?|\\.?|[^,'\\]+)*", re.DOTALL)
+_SQL_STRUCTURE_RE = re.compile(r"'[^'\\]*(?:\\.[^'\\]*)*'?|\\.?|[()]", re.DOTALL)
+
+def chunks(items: Sequence, size: int) -> Iterator[Sequence]:
+    """
+    Yields consecutive slices of at most `size` items.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 def _split_sql_values(values_str: str) -> List[str]:
     """
     Splits a VALUES(...) list into individual SQL literals, respecting quotes and escapes.
     """
-    out, buf, in_str, esc = [], [], False, False
-    for ch in values_str:
-        if esc:
-            buf.append(ch)
-            esc = False
-            continue
-        if ch == "\\":
-            buf.append(ch)
-            esc = True
-            continue
-        if ch == "'" and not in_str:
-            in_str = True
-            buf.append(ch)
-            continue
-        if ch == "'" and in_str:
-            in_str = False
-            buf.append(ch)
-            continue
-        if ch == "," and not in_str:
-            out.append("".join(buf).strip())
-            buf = []
-            continue
-        buf.append(ch)
-    if buf:
-        out.append("".join(buf).strip())
+    out, pos, n = [], 0, len(values_str)
+    while True:
+        # The field regex stops only at a top-level comma or the end of input.
+        end = _SQL_FIELD_RE.match(values_str, pos).end()
+        field = values_str[pos:end]
+        if end >= n:
+            if field:
+                out.append(field.strip())
+            return out
+        out.append(field.strip())
+        pos = end + 1
+
+def _split_sql_tuples(values_str: str) -> List[str]:
+    """
+    Splits a multi-row VALUES list "(...),(...)" into the inner text of each
+    tuple, respecting quotes and escapes.
+    """
+    out, start, depth = [], 0, 0
+    # Only quoted strings, escapes and parens are visited; other text is skipped in C.
+    for m in _SQL_STRUCTURE_RE.finditer(values_str):
+        tok = m.group()
+        if tok == "(":
+            depth += 1
+            if depth == 1:
+                start = m.end()
+        elif tok == ")":
+            depth -= 1
+            if depth == 0:
+                out.append(values_str[start:m.start()])
     return out
 
+def _tokenize_sql_tuples(values_str: str) -> Optional[List[List[str]]]:
+    """
+    Regex counterpart of _split_sql_tuples + _split_sql_values: returns the
+    literal tokens of each "(...)" tuple, or None if the parens don't nest as
+    flat tuples.
+    """
+    rows: List[List[str]] = []
+    cur: Optional[List[str]] = None
+    for tok in _SQL_TOKEN_RE.findall(values_str):
+        if tok == "(":
+            if cur is not None:
+                return None
+            cur = []
+        elif tok == ")":
+            if cur is None:
+                return None
+            rows.append(cur)
+            cur = None
+        elif cur is None:
+            return None
+        else:
+            cur.append(tok)
+    return rows if cur is None else None
+
 def _sql_literal_to_python(token: str):
     """
     Converts a SQL literal token to Python value.
@@ -52,29 +108,94 @@ def _sql_literal_to_python(token: str):
     except Exception:
         return token
 
-def parse_product_rows_from_sql() -> List[Dict]:
-    """
-    Parses INSERT INTO `products` ... VALUES (...) lines from product_details.sql.
-    Returns list of dict rows.
-    """
-    if not os.path.exists(SQL_DUMP_PATH):
-        return []
+def _parse_sql_dump() -> List[Dict]:
     rows: List[Dict] = []
-    with open(SQL_DUMP_PATH, "r", encoding="utf-8") as f:
+    with open(SQL_DUMP_PATH, "r", encoding="utf-8", buffering=1 << 20) as f:
         for line in f:
             line = line.strip()
             if not line.startswith("INSERT INTO `products`"):
                 continue
-            m = re.search(r"INSERT INTO `products` \((.*?)\) VALUES \((.*)\);$", line)
+            m = _INSERT_RE.match(line)
             if not m:
                 continue
             columns_str, values_str = m.group(1), m.group(2)
             cols = [c.strip().strip("`") for c in columns_str.split(",")]
-            tokens = _split_sql_values(values_str)
-            pyvals = [_sql_literal_to_python(t) for t in tokens]
-            if len(cols) != len(pyvals):
-                continue
-            row = {c: v for c, v in zip(cols, pyvals)}
-            rows.append(row)
+            tuples = _tokenize_sql_tuples(values_str)
+            if tuples is None or any(len(t) != len(cols) for t in tuples):
+                # Literals the regex doesn't know (e.g. unquoted keywords):
+                # use the character-level splitter for this statement.
+                tuples = [_split_sql_values(t) for t in _split_sql_tuples(values_str)]
+            for tokens in tuples:
+                pyvals = [_sql_literal_to_python(t) for t in tokens]
+                if len(cols) != len(pyvals):
+                    continue
+                row = {c: v for c, v in zip(cols, pyvals)}
+                rows.append(row)
     return rows
 
+def _dump_signature() -> Dict:
+    st = os.stat(SQL_DUMP_PATH)
+    return {"source_mtime_ns": st.st_mtime_ns, "source_size": st.st_size}
+
+def _read_parsed_dump(signature: Dict) -> Optional[List[Dict]]:
+    """
+    Returns rows from the preprocessed JSONL sidecar if it was built from the
+    current dump (first line records the dump's mtime and size).
+    """
+    try:
+        with open(PARSED_DUMP_PATH, "r", encoding="utf-8") as f:
+            if json.loads(f.readline() or "null") != signature:
+                return None
+            return [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        return None
+
+def _write_parsed_dump(signature: Dict, rows: List[Dict]):
+    try:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=DATA_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(json.dumps(signature) + "\n")
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        os.replace(tmp, PARSED_DUMP_PATH)
+    except OSError:
+        pass
+
+def parse_product_rows_from_sql() -> List[Dict]:
+    """
+    Parses INSERT INTO `products` ... VALUES (...)[, (...)] lines from product_details.sql.
+    Handles both single-row and multi-row (extended) INSERT statements.
+    The parsed rows are kept in a JSONL sidecar (data/product_details.jsonl) so
+    later calls and restarts skip the SQL tokenizer until the dump changes.
+    Returns list of dict rows.
+    """
+    if not os.path.exists(SQL_DUMP_PATH):
+        return []
+    signature = _dump_signature()
+    rows = _read_parsed_dump(signature)
+    if rows is None:
+        rows = _parse_sql_dump()
+        _write_parsed_dump(signature, rows)
+    return rows
+
+@lru_cache(maxsize=1)
+def _sql_rows_by_id(mtime: float) -> Dict[int, Dict]:
+    rows: Dict[int, Dict] = {}
+    for row in parse_product_rows_from_sql():
+        try:
+            rows[int(row.get("id"))] = row
+        except Exception:
+            continue
+    return rows
+
+def sql_rows_by_id() -> Dict[int, Dict]:
+    """
+    Returns product_details.sql rows keyed by id.
+    Parsed once and cached until the dump file's mtime changes.
+    """
+    try:
+        mtime = os.path.getmtime(SQL_DUMP_PATH)
+    except OSError:
+        return {}
+    return _sql_rows_by_id(mtime)
@@ -0,0 +1,11 @@
+"""
+WSGI entrypoint for production servers:
+
+    gunicorn wsgi:application -k gthread --workers 1 --threads 16
+
+Keep a single worker so the FAISS index and model are loaded once and shared
+by all request threads.
+"""
+from faiss_api.app import create_app
+
+application = create_app()